@@ -1,105 +1,185 @@
 import os
 import uuid
 import datetime as dt
+import hashlib
 import sqlite3
-from typing import Optional, List, Dict, Any
-
-from fastapi import FastAPI, HTTPException
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Iterator
+
+import orjson
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 
 DB_PATH = os.getenv("APP_DB_PATH", "app.db")
 
-app = FastAPI(title="Tarot MiniApp Backend", version="0.1.0")
+app = FastAPI(
+    title="Tarot MiniApp Backend",
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+)
+# Кириллица в UTF-8 — по 2 байта на символ, JSON с текстами раскладов хорошо жмётся
+app.add_middleware(GZipMiddleware, minimum_size=512)
 
 
-def db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Одно соединение на процесс (autocommit), доступ сериализуется локом:
+# синхронные роуты FastAPI выполняются в пуле потоков. Соединение же держит
+# кэш подготовленных выражений (SQL вынесен в константы _SQL_* ниже).
+_CONN = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=128)
+_CONN.row_factory = sqlite3.Row
+_LOCK = threading.Lock()
 
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
 
-def init_db() -> None:
-    conn = db()
-    cur = conn.cursor()
 
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY,
-        telegram_user_id INTEGER UNIQUE NOT NULL,
-        username TEXT,
-        created_at TEXT NOT NULL
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS spreads (
-        id TEXT PRIMARY KEY,
-        title TEXT NOT NULL,
-        description TEXT,
-        price_stars INTEGER NOT NULL,
-        is_active INTEGER NOT NULL DEFAULT 1
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS sessions (
-        id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
-        spread_id TEXT NOT NULL,
-        status TEXT NOT NULL,
-        payload_json TEXT,
-        result_json TEXT,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL,
-        FOREIGN KEY(user_id) REFERENCES users(id),
-        FOREIGN KEY(spread_id) REFERENCES spreads(id)
-    )
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS payments (
-        id TEXT PRIMARY KEY,
-        session_id TEXT NOT NULL,
-        provider TEXT NOT NULL,
-        status TEXT NOT NULL,
-        telegram_charge_id TEXT,
-        amount_stars INTEGER NOT NULL,
-        created_at TEXT NOT NULL,
-        FOREIGN KEY(session_id) REFERENCES sessions(id)
-    )
-    """)
+@contextmanager
+def db() -> Iterator[sqlite3.Connection]:
+    with _LOCK:
+        yield _CONN
 
-    conn.commit()
-    conn.close()
+
+@contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[sqlite3.Cursor]:
+    """Явная транзакция поверх autocommit-соединения: один COMMIT на блок."""
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    try:
+        yield cur
+    except BaseException:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+
+
+def init_db(conn: sqlite3.Connection) -> None:
+    # journal_mode нельзя менять внутри транзакции — прагмы до BEGIN
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+
+    with transaction(conn) as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            telegram_user_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            created_at TEXT NOT NULL
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS spreads (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT,
+            price_stars INTEGER NOT NULL,
+            is_active INTEGER NOT NULL DEFAULT 1
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            spread_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload_json TEXT,
+            result_json TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(spread_id) REFERENCES spreads(id)
+        )
+        """)
+
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id TEXT PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            status TEXT NOT NULL,
+            telegram_charge_id TEXT,
+            amount_stars INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(session_id) REFERENCES sessions(id)
+        )
+        """)
+
+        # users.telegram_user_id уже покрыт неявным индексом от UNIQUE
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_sessions_user ON sessions(user_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_sessions_updated ON sessions(updated_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_payments_session ON payments(session_id)")
 
 
 @app.on_event("startup")
 def _startup():
-    init_db()
-    seed_spreads_if_empty()
+    with db() as conn:
+        init_db(conn)
+        seed_spreads_if_empty(conn)
+    refresh_spreads_cache()
 
 
 def now_iso() -> str:
-    return dt.datetime.utcnow().replace(tzinfo=dt.timezone.utc).isoformat()
-
-
-def seed_spreads_if_empty():
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(1) AS c FROM spreads")
-    c = int(cur.fetchone()["c"])
-    if c == 0:
-        spreads = [
-            ("spread_3cards", "🔮 Расклад 3 карты", "Прошлое / Настоящее / Будущее", 50, 1),
-            ("spread_love", "❤️ Любовный расклад", "Ситуация / Его мысли / Твой шаг", 75, 1),
-        ]
-        for sid, title, desc, price, active in spreads:
-            cur.execute(
+    return dt.datetime.now(dt.timezone.utc).isoformat()
+
+
+def seed_spreads_if_empty(conn: sqlite3.Connection) -> None:
+    with transaction(conn) as cur:
+        cur.execute("SELECT COUNT(1) AS c FROM spreads")
+        c = int(cur.fetchone()["c"])
+        if c == 0:
+            spreads = [
+                ("spread_3cards", "🔮 Расклад 3 карты", "Прошлое / Настоящее / Будущее", 50, 1),
+                ("spread_love", "❤️ Любовный расклад", "Ситуация / Его мысли / Твой шаг", 75, 1),
+            ]
+            cur.executemany(
                 "INSERT INTO spreads (id, title, description, price_stars, is_active) VALUES (?, ?, ?, ?, ?)",
-                (sid, title, desc, price, active),
+                spreads,
             )
-        conn.commit()
-    conn.close()
+
+
+# -------------------------
+# SQL
+# -------------------------
+_SQL_UPSERT_USER = """
+    INSERT INTO users (id, telegram_user_id, username, created_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT(telegram_user_id) DO UPDATE SET username = COALESCE(excluded.username, users.username)
+    RETURNING id
+"""
+
+_SQL_SELECT_SPREADS = "SELECT id, title, description, price_stars, is_active FROM spreads ORDER BY price_stars ASC"
+
+_SQL_INSERT_SESSION = """
+    INSERT INTO sessions (id, user_id, spread_id, status, payload_json, result_json, created_at, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_GET_SESSION_PRICE = """
+    SELECT s.id, s.status, sp.price_stars
+    FROM sessions s
+    JOIN spreads sp ON sp.id = s.spread_id
+    WHERE s.id = ?
+"""
+
+_SQL_GET_SESSION = (
+    "SELECT id, spread_id, status, payload_json, result_json, created_at, updated_at FROM sessions WHERE id = ?"
+)
+
+_SQL_GET_SESSION_STATUS = "SELECT id, status FROM sessions WHERE id = ?"
+
+_SQL_SET_SESSION_STATUS = "UPDATE sessions SET status = ?, updated_at = ? WHERE id = ?"
+
+_SQL_INSERT_PAYMENT = """
+    INSERT INTO payments (id, session_id, provider, status, telegram_charge_id, amount_stars, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
 
 
 # -------------------------
@@ -146,54 +226,66 @@ class PaymentEventIn(BaseModel):
 # -------------------------
 # Helpers
 # -------------------------
-def get_or_create_user(telegram_user_id: int, username: Optional[str]) -> str:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE telegram_user_id = ?", (telegram_user_id,))
-    row = cur.fetchone()
-    if row:
-        user_id = row["id"]
-        if username:
-            cur.execute("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
-            conn.commit()
-        conn.close()
-        return user_id
-
-    user_id = str(uuid.uuid4())
-    cur.execute(
-        "INSERT INTO users (id, telegram_user_id, username, created_at) VALUES (?, ?, ?, ?)",
-        (user_id, telegram_user_id, username, now_iso()),
-    )
-    conn.commit()
-    conn.close()
-    return user_id
+def get_or_create_user(telegram_user_id: int, username: Optional[str], now: Optional[str] = None) -> str:
+    # UPSERT ... RETURNING (SQLite >= 3.35): один запрос вместо SELECT + UPDATE/INSERT
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            _SQL_UPSERT_USER,
+            (str(uuid.uuid4()), telegram_user_id, username or None, now or now_iso()),
+        )
+        return cur.fetchone()["id"]
+
+
+# Справочник раскладов меняется только при сиде, поэтому держим его в памяти.
+# Любая запись в spreads должна заканчиваться вызовом refresh_spreads_cache().
+_SPREADS: Dict[str, sqlite3.Row] = {}
+_SPREADS_BODY = b"[]"
+_SPREADS_ETAG = ""
+
+SPREADS_CACHE_CONTROL = "public, max-age=300"
+
+
+def refresh_spreads_cache() -> None:
+    global _SPREADS, _SPREADS_BODY, _SPREADS_ETAG
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute(_SQL_SELECT_SPREADS)
+        rows = cur.fetchall()
+
+    active = [
+        {"id": r["id"], "title": r["title"], "description": r["description"], "price_stars": r["price_stars"]}
+        for r in rows
+        if int(r["is_active"]) == 1
+    ]
+
+    _SPREADS = {r["id"]: r for r in rows}
+    # Ответ /spreads сериализуем один раз — отдаём готовые байты
+    _SPREADS_BODY = orjson.dumps(active)
+    _SPREADS_ETAG = '"%s"' % hashlib.md5(_SPREADS_BODY).hexdigest()
 
 
 def spread_exists(spread_id: str) -> Optional[sqlite3.Row]:
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, title, description, price_stars, is_active FROM spreads WHERE id = ?",
-        (spread_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return _SPREADS.get(spread_id)
 
 
 # -------------------------
 # Routes
 # -------------------------
-@app.get("/api/v1/spreads", response_model=List[SpreadOut])
-def list_spreads():
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, title, description, price_stars FROM spreads WHERE is_active = 1 ORDER BY price_stars ASC"
-    )
-    rows = cur.fetchall()
-    conn.close()
-    return [SpreadOut(**dict(r)) for r in rows]
+# Read-роуты отдают готовый JSON без прогонки через Pydantic;
+# модели остаются в responses= только для схемы OpenAPI.
+@app.get("/api/v1/spreads", responses={200: {"model": List[SpreadOut]}})
+def list_spreads(request: Request):
+    headers = {"ETag": _SPREADS_ETAG, "Cache-Control": SPREADS_CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match", "").strip()
+    # "*" совпадает с любым текущим представлением (RFC 9110, 13.1.2)
+    if if_none_match == "*" or _SPREADS_ETAG in (
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=_SPREADS_BODY, media_type="application/json", headers=headers)
 
 
 @app.post("/api/v1/sessions", response_model=SessionOut)
@@ -202,21 +294,22 @@ def create_session(payload: SessionCreateIn):
     if not srow or int(srow["is_active"]) != 1:
         raise HTTPException(status_code=404, detail="Spread not found or inactive")
 
-    user_id = get_or_create_user(payload.telegram_user_id, payload.username)
-    session_id = str(uuid.uuid4())
+    # orjson не умеет целые за пределами 64 бит — такой payload не сохранить и не отдать обратно
+    try:
+        payload_json = json_dumps(payload.payload)
+    except orjson.JSONEncodeError as e:
+        raise HTTPException(status_code=422, detail=f"Unsupported payload: {e}")
+
     created = now_iso()
+    user_id = get_or_create_user(payload.telegram_user_id, payload.username, created)
+    session_id = str(uuid.uuid4())
 
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO sessions (id, user_id, spread_id, status, payload_json, result_json, created_at, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (session_id, user_id, payload.spread_id, "created", json_dumps(payload.payload), None, created, created),
-    )
-    conn.commit()
-    conn.close()
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            _SQL_INSERT_SESSION,
+            (session_id, user_id, payload.spread_id, "created", payload_json, None, created, created),
+        )
 
     return SessionOut(
         id=session_id,
@@ -231,103 +324,79 @@ def create_session(payload: SessionCreateIn):
 
 @app.post("/api/v1/sessions/{session_id}/start_payment", response_model=StartPaymentOut)
 def start_payment(session_id: str):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        SELECT s.id, s.status, sp.price_stars
-        FROM sessions s
-        JOIN spreads sp ON sp.id = s.spread_id
-        WHERE s.id = ?
-        """,
-        (session_id,),
-    )
-    row = cur.fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Session not found")
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute(_SQL_GET_SESSION_PRICE, (session_id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Session not found")
 
-    if row["status"] in ("paid", "delivered"):
-        conn.close()
-        return StartPaymentOut(session_id=session_id, amount_stars=int(row["price_stars"]), status=row["status"])
+        amount = int(row["price_stars"])
+        if row["status"] in ("paid", "delivered"):
+            return StartPaymentOut(session_id=session_id, amount_stars=amount, status=row["status"])
 
-    amount = int(row["price_stars"])
-    cur.execute(
-        "UPDATE sessions SET status = ?, updated_at = ? WHERE id = ?",
-        ("pending_payment", now_iso(), session_id),
-    )
-    conn.commit()
-    conn.close()
+        cur.execute(_SQL_SET_SESSION_STATUS, ("pending_payment", now_iso(), session_id))
 
     # На этом шаге Mini App/бот понимает сумму Stars.
     # Реальный invoice создаст бот; он же позже пришлёт PaymentEventIn.
     return StartPaymentOut(session_id=session_id, amount_stars=amount, status="pending_payment")
 
 
-@app.get("/api/v1/sessions/{session_id}", response_model=SessionOut)
+@app.get("/api/v1/sessions/{session_id}", responses={200: {"model": SessionOut}})
 def get_session(session_id: str):
-    conn = db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, spread_id, status, payload_json, result_json, created_at, updated_at FROM sessions WHERE id = ?",
-        (session_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with db() as conn:
+        cur = conn.cursor()
+        cur.execute(_SQL_GET_SESSION, (session_id,))
+        row = cur.fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Session not found")
 
     payload = json_loads(row["payload_json"]) if row["payload_json"] else {}
     result = json_loads(row["result_json"]) if row["result_json"] else None
 
-    return SessionOut(
-        id=row["id"],
-        spread_id=row["spread_id"],
-        status=row["status"],
-        payload=payload,
-        result=result,
-        created_at=row["created_at"],
-        updated_at=row["updated_at"],
-    )
+    return ORJSONResponse({
+        "id": row["id"],
+        "spread_id": row["spread_id"],
+        "status": row["status"],
+        "payload": payload,
+        "result": result,
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    })
 
 
 @app.post("/api/v1/telegram/payment_event")
 def payment_event(evt: PaymentEventIn):
-    conn = db()
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, status FROM sessions WHERE id = ?", (evt.session_id,))
-    s = cur.fetchone()
-    if not s:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Session not found")
+    now = now_iso()
+    # INSERT платежа и UPDATE сессии — одна транзакция, один COMMIT
+    with db() as conn, transaction(conn) as cur:
+        cur.execute(_SQL_GET_SESSION_STATUS, (evt.session_id,))
+        s = cur.fetchone()
+        if not s:
+            raise HTTPException(status_code=404, detail="Session not found")
+
+        payment_id = str(uuid.uuid4())
+        cur.execute(
+            _SQL_INSERT_PAYMENT,
+            (payment_id, evt.session_id, evt.provider, evt.status, evt.telegram_charge_id, evt.amount_stars, now),
+        )
+
+        if evt.status == "paid":
+            cur.execute(_SQL_SET_SESSION_STATUS, ("paid", now, evt.session_id))
+        else:
+            cur.execute(_SQL_SET_SESSION_STATUS, ("created", now, evt.session_id))
 
-    payment_id = str(uuid.uuid4())
-    cur.execute(
-        """
-        INSERT INTO payments (id, session_id, provider, status, telegram_charge_id, amount_stars, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        """,
-        (payment_id, evt.session_id, evt.provider, evt.status, evt.telegram_charge_id, evt.amount_stars, now_iso()),
-    )
-
-    if evt.status == "paid":
-        cur.execute("UPDATE sessions SET status = ?, updated_at = ? WHERE id = ?", ("paid", now_iso(), evt.session_id))
-    else:
-        cur.execute("UPDATE sessions SET status = ?, updated_at = ? WHERE id = ?", ("created", now_iso(), evt.session_id))
-
-    conn.commit()
-    conn.close()
     return {"ok": True}
 
 
 # -------------------------
 # Small JSON helpers
 # -------------------------
-import json as _json
-
+# orjson всегда пишет UTF-8 без экранирования кириллицы;
+# в TEXT-колонку SQLite кладём str, поэтому decode().
+# Целые больше 64 бит orjson не сериализует (orjson.JSONEncodeError, подкласс TypeError).
 def json_dumps(obj: Any) -> str:
-    return _json.dumps(obj, ensure_ascii=False)
+    return orjson.dumps(obj).decode()
 
 def json_loads(s: str) -> Any:
-    return _json.loads(s)
+    return orjson.loads(s)
@@ -1,13 +1,16 @@
 import os
 import random
+import asyncio
 import datetime
+import time
 from io import BytesIO
 import re
 import json
 import sqlite3
 
+import orjson
 from PIL import Image
-import requests
+import httpx
 
 from telegram import (
     Update,
@@ -15,6 +18,7 @@ from telegram import (
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
 )
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -25,11 +29,20 @@ from telegram.ext import (
 )
 
 # =====================
-# БД для статистики (пока не используется в хэндлерах, оставляю как есть)
+# БД: статистика (пока не используется в хэндлерах) и дневные сессии
 # =====================
 conn = sqlite3.connect("stats.db", check_same_thread=False)
 cursor = conn.cursor()
 
+# WAL + synchronous=NORMAL: коммит без fsync на каждую запись.
+# auto_vacuum применяется только к новой (пустой) БД — для старой нужен разовый VACUUM.
+cursor.executescript("""
+PRAGMA auto_vacuum=INCREMENTAL;
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+""")
+
 cursor.execute("""
 CREATE TABLE IF NOT EXISTS stats (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -39,6 +52,29 @@ CREATE TABLE IF NOT EXISTS stats (
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
 )
 """)
+cursor.execute("CREATE INDEX IF NOT EXISTS idx_stats_user_ts ON stats(user_id, timestamp DESC)")
+
+# Сессия "карты дня": одна строка на (user_id, дата), старые дни чистит sweep_daily_sessions
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS daily_sessions (
+    user_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    sphere TEXT NOT NULL,
+    choices_json BLOB NOT NULL,
+    picked INTEGER,
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID
+""")
+
+# file_id, который Telegram выдал при первой загрузке картинки карты
+cursor.execute("""
+CREATE TABLE IF NOT EXISTS card_file_ids (
+    filename TEXT NOT NULL,
+    reversed INTEGER NOT NULL,
+    file_id TEXT NOT NULL,
+    PRIMARY KEY (filename, reversed)
+) WITHOUT ROWID
+""")
 conn.commit()
 
 # =====================
@@ -53,13 +89,31 @@ BASE_CDN = os.getenv(
     "https://raw.githubusercontent.com/VictorWard18/Tarot_PA_bot/main/assets",
 )
 
-# Простое in-memory хранилище сессий (для локального MVP)
-STATE = {}  # key: (user_id, date_str) -> {"sphere": ..., "choices": [...], "picked": int|None}
+# Один HTTP-клиент на процесс: keep-alive до CDN, не блокирует event loop.
+# Закрывается в on_shutdown.
+HTTP_CLIENT = httpx.AsyncClient(
+    base_url=BASE_CDN,
+    http2=True,
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=8),
+)
+
+# (filename, reversed) -> готовые байты картинки
+CARD_BYTES_CACHE = {}
+
+
+# (момент следующей полуночи в unix-времени, дата строкой)
+_TODAY_CACHE = (0.0, "")
 
 
 def today_str() -> str:
     """Дата как строка (можно потом привязать к часовому поясу Дубая)."""
-    return datetime.date.today().isoformat()
+    global _TODAY_CACHE
+    if time.time() >= _TODAY_CACHE[0]:
+        today = datetime.date.today()
+        midnight = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time.min)
+        _TODAY_CACHE = (midnight.timestamp(), today.isoformat())
+    return _TODAY_CACHE[1]
 
 
 # =====================
@@ -91,6 +145,20 @@ SPHERE_RU = {
     "general": "Общая",
 }
 
+SPHERES_INLINE = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(name, callback_data=f"sphere:{key}")] for key, name in SPHERE_RU.items()]
+    + [[InlineKeyboardButton("🏠 В начало", callback_data="nav:home")]]
+)
+
+PICK_INLINE = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("1️⃣", callback_data="pick:0"),
+        InlineKeyboardButton("2️⃣", callback_data="pick:1"),
+        InlineKeyboardButton("3️⃣", callback_data="pick:2"),
+    ],
+    [InlineKeyboardButton("🏠 В начало", callback_data="nav:home")],
+])
+
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = "🔮 *Карта дня*\n\nВыбери действие ниже 👇"
@@ -101,18 +169,11 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def show_spheres(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    kb = [
-        [InlineKeyboardButton("Работа", callback_data="sphere:work")],
-        [InlineKeyboardButton("Личная жизнь", callback_data="sphere:love")],
-        [InlineKeyboardButton("Здоровье", callback_data="sphere:health")],
-        [InlineKeyboardButton("Общая", callback_data="sphere:general")],
-        [InlineKeyboardButton("🏠 В начало", callback_data="nav:home")],
-    ]
     text = "Выбери сферу, для которой хочешь получить карту дня:"
     if update.message:
-        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(kb))
+        await update.message.reply_text(text, reply_markup=SPHERES_INLINE)
     else:
-        await update.effective_chat.send_message(text, reply_markup=InlineKeyboardMarkup(kb))
+        await update.effective_chat.send_message(text, reply_markup=SPHERES_INLINE)
 
 
 async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -136,26 +197,34 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # =====================
 # ЗАГРУЗКА И ПАРСИНГ meanings.json
-# (работаем даже если файл состоит из склеенных JSON-блоков)
+# Формат: один JSON-объект { card_id: {meta, upright, reversed}, ... }.
+# Старый формат из склеенных JSON-блоков читается только с MEANINGS_LEGACY=1
+# (см. iter_json_objects).
 # =====================
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(SCRIPT_DIR, "data")
 MEANINGS_PATH = os.path.join(DATA_DIR, "meanings.json")
+# MEANINGS_LEGACY=1 — meanings.json в старом формате из склеенных JSON-блоков
+MEANINGS_LEGACY = os.getenv("MEANINGS_LEGACY") == "1"
+ASSETS_DIR = os.path.join(SCRIPT_DIR, "assets")
 
 
-def split_concatenated_json_objects(text: str):
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _skip_json_object(text: str, start: int) -> int:
     """
-    Разбиваем строку на последовательность независимых JSON-объектов {...}{...}{...}.
-    Корректно учитываем строки и экранирование.
+    Позиция сразу за объектом {...}, который начинается в start
+    (с учётом строк и экранирования); len(text), если объект не закрыт.
+    Нужна, чтобы целиком пропустить битый блок, не заходя во вложенные объекты.
     """
-    objects = []
     depth = 0
-    start = None
     in_string = False
     escape = False
 
-    for i, ch in enumerate(text):
+    for i in range(start, len(text)):
+        ch = text[i]
         if in_string:
             if escape:
                 escape = False
@@ -163,20 +232,93 @@ def split_concatenated_json_objects(text: str):
                 escape = True
             elif ch == '"':
                 in_string = False
-        else:
-            if ch == '"':
-                in_string = True
-            elif ch == "{":
-                if depth == 0:
-                    start = i
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0 and start is not None:
-                    objects.append(text[start: i + 1])
-                    start = None
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+
+    return len(text)
+
+
+def iter_json_objects(text: str):
+    """
+    Последовательно достаём JSON-объекты {...}{...}{...} из строки.
+    Разбор делает C-декодер json (raw_decode); всё между объектами
+    (пробелы, висящие ключи вида "2ofcups":) пропускаем до следующей '{'.
+    """
+    idx = text.find("{")
+    while idx != -1:
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, idx)
+        except json.JSONDecodeError as e:
+            print(f"Блок с позиции {idx} в meanings.json не распознан как JSON: {e}")
+            idx = text.find("{", _skip_json_object(text, idx))
+            continue
+        yield obj
+        idx = text.find("{", end)
+
+
+_CARD_ID_STRIP = re.compile(r"[^a-z0-9]+")
+
+RANK_RU = {
+    "Туз": "ace",
+    "2": "2",
+    "3": "3",
+    "4": "4",
+    "5": "5",
+    "6": "6",
+    "7": "7",
+    "8": "8",
+    "9": "9",
+    "10": "10",
+    "Паж": "page",
+    "Рыцарь": "knight",
+    "Королева": "queen",
+    "Король": "king",
+}
+
+# подстрока в русском названии -> масть
+SUIT_RU = {
+    "Кубк": "cups",
+    "Пентакл": "pentacles",
+    "Меч": "swords",
+    "Жезл": "wands",
+}
 
-    return objects
+RANK_EN = {
+    "ace": "ace",
+    "two": "2",
+    "three": "3",
+    "four": "4",
+    "five": "5",
+    "six": "6",
+    "seven": "7",
+    "eight": "8",
+    "nine": "9",
+    "ten": "10",
+    "page": "page",
+    "knight": "knight",
+    "queen": "queen",
+    "king": "king",
+}
+
+
+def iter_meaning_blocks(whole):
+    """
+    Блоки meanings.json для load_meanings из уже разобранного JSON:
+    {card_id: {...}, ...}, список блоков или один блок.
+    """
+    if isinstance(whole, list):
+        yield from whole
+    elif isinstance(whole, dict) and not whole.keys() & {"meta", "upright", "reversed"}:
+        for card_id, card_data in whole.items():
+            yield {card_id: card_data}
+    else:
+        yield whole
 
 
 def infer_card_id(obj: dict) -> str:
@@ -192,75 +334,36 @@ def infer_card_id(obj: dict) -> str:
     if arcana == "major":
         base = en or ru
         base = base.lower()
-        cid = re.sub(r"[^a-z0-9]+", "", base)
+        cid = _CARD_ID_STRIP.sub("", base)
         return cid or "majorarcana"
 
     if arcana == "minor":
         suit = meta.get("suit")
         if not suit:
-            if "Кубк" in ru:
-                suit = "cups"
-            elif "Пентакл" in ru:
-                suit = "pentacles"
-            elif "Меч" in ru:
-                suit = "swords"
-            elif "Жезл" in ru:
-                suit = "wands"
+            suit = next((v for k, v in SUIT_RU.items() if k in ru), None)
 
         rank_word = None
         if en:
             rank_word = en.split()[0].lower()
         else:
             first_ru = ru.split()[0] if ru else ""
-            mapping_ru = {
-                "Туз": "ace",
-                "2": "2",
-                "3": "3",
-                "4": "4",
-                "5": "5",
-                "6": "6",
-                "7": "7",
-                "8": "8",
-                "9": "9",
-                "10": "10",
-                "Паж": "page",
-                "Рыцарь": "knight",
-                "Королева": "queen",
-                "Король": "king",
-            }
-            rank_word = mapping_ru.get(first_ru)
-
-        mapping_en = {
-            "ace": "ace",
-            "two": "2",
-            "three": "3",
-            "four": "4",
-            "five": "5",
-            "six": "6",
-            "seven": "7",
-            "eight": "8",
-            "nine": "9",
-            "ten": "10",
-            "page": "page",
-            "knight": "knight",
-            "queen": "queen",
-            "king": "king",
-        }
-
-        rank = mapping_en.get(rank_word, rank_word or "card")
+            rank_word = RANK_RU.get(first_ru)
+
+        rank = RANK_EN.get(rank_word, rank_word or "card")
         if not suit:
             suit = "unknown"
 
         return f"{rank}of{suit}"
 
     base = en or ru or "card"
-    return re.sub(r"[^a-z0-9]+", "", base.lower()) or "card"
+    return _CARD_ID_STRIP.sub("", base.lower()) or "card"
 
 
 def load_meanings(path: str) -> dict:
     """
-    Загружаем meanings из файла, даже если там много склеенных JSON-блоков.
-    Собираем единый словарь вида { card_id: {meta, upright, reversed}, ... }.
+    Загружаем meanings из файла (один JSON-объект; склеенные JSON-блоки — только
+    с MEANINGS_LEGACY=1). Собираем единый словарь вида { card_id: {meta, upright, reversed}, ... }.
+    Если файл не разбирается — пишем ошибку и возвращаем {}.
     """
     if not os.path.exists(path):
         print(f"Файл meanings.json не найден по пути: {path}")
@@ -269,19 +372,17 @@ def load_meanings(path: str) -> dict:
     with open(path, "r", encoding="utf-8") as f:
         text = f.read()
 
-    objects_text = split_concatenated_json_objects(text)
-    if not objects_text:
-        print("В meanings.json не найдено ни одного JSON-объекта.")
-        return {}
-
-    result = {}
-    for idx, obj_text in enumerate(objects_text):
+    if MEANINGS_LEGACY:
+        blocks = iter_json_objects(text)
+    else:
         try:
-            obj = json.loads(obj_text)
-        except json.JSONDecodeError as e:
-            print(f"Блок #{idx} в meanings.json не распознан как JSON: {e}")
-            continue
+            blocks = iter_meaning_blocks(orjson.loads(text))
+        except orjson.JSONDecodeError as e:
+            print(f"Ошибка разбора meanings.json: {e}")
+            return {}
 
+    result = {}
+    for idx, obj in enumerate(blocks):
         keys = list(obj.keys())
         if len(keys) == 1 and keys[0] not in ("meta", "upright", "reversed"):
             card_id = keys[0]
@@ -307,26 +408,30 @@ def load_meanings(path: str) -> dict:
 MEANINGS = load_meanings(MEANINGS_PATH)
 
 
-def get_card_text(filename: str, sphere: str, is_reversed: bool, lang: str = "ru"):
+def card_id_from_filename(filename: str) -> str:
     """
-    Возвращаем (title, text) для карты из MEANINGS.
+    'thefool_upright.png' -> 'thefool'.
     """
     base = os.path.splitext(os.path.basename(filename))[0]
 
     if base.endswith("_upright"):
-        card_id = base[:-len("_upright")]
-    elif base.endswith("_reversed"):
-        card_id = base[:-len("_reversed")]
-    else:
-        card_id = base
+        return base[:-len("_upright")]
+    if base.endswith("_reversed"):
+        return base[:-len("_reversed")]
+    return base
+
+
+NO_TEXT = "Описание этой карты пока не добавлено."
+MEANING_LANGS = ("ru", "en")
 
-    orientation = "reversed" if is_reversed else "upright"
 
+def _resolve_card_text(card_id: str, orientation: str, sphere_key: str, lang: str):
+    """
+    (title, text) для карты из MEANINGS со всеми фолбэками по языку и сфере.
+    """
     card_data = MEANINGS.get(card_id)
     if not card_data:
-        title = card_id
-        text = "Описание этой карты пока не добавлено."
-        return title, text
+        return card_id, NO_TEXT
 
     meta = card_data.get("meta", {})
     titles = meta.get("titles", {})
@@ -338,14 +443,37 @@ def get_card_text(filename: str, sphere: str, is_reversed: bool, lang: str = "ru
     )
 
     block = card_data.get(orientation, {})
-    sphere_key = sphere if sphere in ("general", "work", "love", "health") else "general"
     sphere_block = block.get(sphere_key) or block.get("general") or {}
     text = sphere_block.get(lang) or sphere_block.get("ru") or ""
 
-    if not text:
-        text = "Описание этой карты пока не добавлено."
+    return title, text or NO_TEXT
 
-    return title, text
+
+# MEANINGS после загрузки не меняется — раскладываем его заранее в плоский словарь
+# (card_id, orientation, sphere, lang) -> (title, text), с уже применёнными фолбэками
+FLAT_MEANINGS = {
+    (card_id, orientation, sphere_key, lang): _resolve_card_text(card_id, orientation, sphere_key, lang)
+    for card_id in MEANINGS
+    for orientation in ("upright", "reversed")
+    for sphere_key in SPHERE_RU
+    for lang in MEANING_LANGS
+}
+
+
+def get_card_text(card_idx: int, sphere: str, is_reversed: bool, lang: str = "ru"):
+    """
+    Возвращаем (title, text) для карты номер card_idx (индекс в CARD_FILES) из MEANINGS.
+    """
+    card_id = CARD_IDS[card_idx]
+    orientation = "reversed" if is_reversed else "upright"
+    sphere_key = sphere if sphere in SPHERE_RU else "general"
+
+    key = (card_id, orientation, sphere_key, lang)
+    found = FLAT_MEANINGS.get(key)
+    if found is None:
+        # карты нет в meanings.json или редкий язык — считаем по-честному
+        found = _resolve_card_text(*key)
+    return found
 
 
 # =====================
@@ -357,15 +485,15 @@ def load_card_filenames():
     Возвращает список файлов карт из папки assets.
     Важно, чтобы имена совпадали с теми, что лежат в GitHub.
     """
-    assets_dir = os.path.join(os.path.dirname(__file__), "assets")
+    assets_dir = ASSETS_DIR
     if not os.path.isdir(assets_dir):
         raise RuntimeError(f"Папка assets не найдена по пути: {assets_dir}")
 
-    files = [
-        f for f in os.listdir(assets_dir)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ]
-    files.sort()
+    with os.scandir(assets_dir) as it:
+        files = sorted(
+            e.name for e in it
+            if e.is_file() and e.name.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
     if not files:
         raise RuntimeError("В папке assets нет файлов карт.")
     return files
@@ -373,47 +501,188 @@ def load_card_filenames():
 
 CARD_FILES = load_card_filenames()
 NUM_CARDS = len(CARD_FILES)
+CARD_IDS = [card_id_from_filename(f) for f in CARD_FILES]  # параллельно CARD_FILES
+
+
+# Свой экземпляр генератора: не делим состояние с модулем random и другими библиотеками
+_RNG = random.Random()
 
 
 def draw_three_cards():
     """
     Выбираем 3 уникальных карты по индексам и случайно решаем, перевёрнутые они или нет.
+    Возвращаем список пар (idx, reversed); ориентации — три бита одного getrandbits.
     """
-    idxs = random.sample(range(NUM_CARDS), 3)
-    return [{"idx": i, "rev": random.random() < 0.5} for i in idxs]
+    idxs = _RNG.sample(range(NUM_CARDS), 3)
+    revs = _RNG.getrandbits(3)
+    return [(i, bool(revs >> k & 1)) for k, i in enumerate(idxs)]
 
 
 def get_card_filename(card_idx: int) -> str:
     return CARD_FILES[card_idx]
 
 
-def fetch_and_rotate_image(filename: str, reversed_card: bool) -> BytesIO:
+def _rotate_180(content: bytes) -> bytes:
     """
-    Скачиваем картинку по raw-URL из GitHub и при необходимости переворачиваем на 180°.
+    Переворачиваем картинку на 180° и кодируем обратно.
+    Чистый CPU — вызывается в пуле потоков, чтобы не блокировать event loop.
     """
-    url = f"{BASE_CDN}/{filename}"
-    resp = requests.get(url)
-    resp.raise_for_status()
-
-    img = Image.open(BytesIO(resp.content))
-
-    if reversed_card:
-        img = img.rotate(180, expand=True)
+    # transpose — перестановка пикселей, без аффинного преобразования как у rotate()
+    img = Image.open(BytesIO(content)).transpose(Image.Transpose.ROTATE_180)
 
     output = BytesIO()
     if img.mode in ("RGBA", "LA"):
-        img.save(output, format="PNG")
+        # Telegram всё равно пережимает фото — экономим CPU, а не байты
+        img.save(output, format="PNG", compress_level=1)
     else:
         img = img.convert("RGB")
-        img.save(output, format="JPEG")
-    output.seek(0)
-    return output
+        img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _load_card_source(filename: str) -> bytes:
+    """
+    Исходные байты картинки: из локальной папки assets, а если её там нет — по raw-URL из GitHub.
+    """
+    try:
+        # PNG карт весят до нескольких МБ — читаем в пуле потоков, как и _rotate_180
+        return await asyncio.to_thread(_read_file, os.path.join(ASSETS_DIR, filename))
+    except FileNotFoundError:
+        # деплой без папки assets — берём с CDN
+        resp = await HTTP_CLIENT.get(f"/{filename}")
+        resp.raise_for_status()
+        return resp.content
+
+
+async def _get_card_bytes(filename: str, reversed_card: bool) -> bytes:
+    """
+    Готовим картинку карты в нужной ориентации.
+    Результат держим в CARD_BYTES_CACHE, пока Telegram не выдал для неё file_id
+    (см. remember_file_id) — дальше байты не нужны.
+    """
+    key = (filename, reversed_card)
+    data = CARD_BYTES_CACHE.get(key)
+    if data is None:
+        if reversed_card:
+            # источник в кэш не кладём: прямая карта может уже уходить по file_id
+            source = CARD_BYTES_CACHE.get((filename, False)) or await _load_card_source(filename)
+            data = await asyncio.to_thread(_rotate_180, source)
+        else:
+            # прямую карту отдаём как есть — без декодирования и перекодирования
+            data = await _load_card_source(filename)
+        CARD_BYTES_CACHE[key] = data
+    return data
+
+
+async def fetch_and_rotate_image(filename: str, reversed_card: bool) -> BytesIO:
+    # Каждый раз новый BytesIO: telegram читает поток до конца
+    return BytesIO(await _get_card_bytes(filename, reversed_card))
+
+
+# (filename, reversed) -> file_id в Telegram; переживает рестарты через card_file_ids
+FILE_ID_CACHE = {
+    (filename, bool(rev)): file_id
+    for filename, rev, file_id in cursor.execute("SELECT filename, reversed, file_id FROM card_file_ids")
+}
+
+
+def remember_file_id(filename: str, reversed_card: bool, file_id: str):
+    FILE_ID_CACHE[(filename, reversed_card)] = file_id
+    # дальше карта уходит по file_id — байты в памяти больше не нужны
+    CARD_BYTES_CACHE.pop((filename, reversed_card), None)
+    cursor.execute(
+        "INSERT OR REPLACE INTO card_file_ids (filename, reversed, file_id) VALUES (?, ?, ?)",
+        (filename, int(reversed_card), file_id),
+    )
+    conn.commit()
+
+
+def forget_file_id(filename: str, reversed_card: bool):
+    FILE_ID_CACHE.pop((filename, reversed_card), None)
+    cursor.execute(
+        "DELETE FROM card_file_ids WHERE filename = ? AND reversed = ?",
+        (filename, int(reversed_card)),
+    )
+    conn.commit()
+
+
+def _is_bad_file_id(error: BadRequest) -> bool:
+    # "Wrong file identifier/http url specified", "Wrong remote file identifier specified", ...
+    text = str(error).lower()
+    return "file identifier" in text or "file reference" in text
+
+
+async def reply_card_photo(message, filename: str, reversed_card: bool, **kwargs):
+    """
+    Отправляем карту ответом на message. Если Telegram уже видел эту картинку —
+    шлём по file_id (без скачивания и загрузки байтов), иначе загружаем и запоминаем file_id.
+    """
+    file_id = FILE_ID_CACHE.get((filename, reversed_card))
+    if file_id:
+        try:
+            return await message.reply_photo(photo=file_id, **kwargs)
+        except BadRequest as e:
+            # file_id привязан к боту: после смены токена он недействителен — загрузим заново.
+            # Прочие ошибки (например, слишком длинная подпись) кэш не трогают.
+            if not _is_bad_file_id(e):
+                raise
+            forget_file_id(filename, reversed_card)
+
+    photo_data = await fetch_and_rotate_image(filename, reversed_card)
+    msg = await message.reply_photo(photo=photo_data, **kwargs)
+    if msg.photo:
+        remember_file_id(filename, reversed_card, msg.photo[-1].file_id)
+    return msg
 
 
 def session_key(user_id: int):
     return (user_id, today_str())
 
 
+# =====================
+# ДНЕВНЫЕ СЕССИИ (таблица daily_sessions)
+# key: (user_id, date_str) -> {"sphere": ..., "choices": [(idx, reversed), ...], "picked": int|None}
+# =====================
+
+def load_session(key):
+    cursor.execute(
+        "SELECT sphere, choices_json, picked FROM daily_sessions WHERE user_id = ? AND date = ?",
+        key,
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    sphere, choices_json, picked = row
+    return {"sphere": sphere, "choices": orjson.loads(choices_json), "picked": picked}
+
+
+def save_session(key, sess: dict):
+    cursor.execute(
+        "INSERT OR REPLACE INTO daily_sessions (user_id, date, sphere, choices_json, picked) VALUES (?, ?, ?, ?, ?)",
+        (*key, sess["sphere"], orjson.dumps(sess["choices"]), sess["picked"]),
+    )
+    conn.commit()
+
+
+def drop_session(key):
+    cursor.execute("DELETE FROM daily_sessions WHERE user_id = ? AND date = ?", key)
+    conn.commit()
+
+
+async def sweep_daily_sessions(context: ContextTypes.DEFAULT_TYPE):
+    # Сессии живут в пределах дня (см. session_key) — всё, что раньше сегодня, уже не нужно
+    cursor.execute("DELETE FROM daily_sessions WHERE date < ?", (today_str(),))
+    conn.commit()
+    # освободившиеся страницы возвращаем ОС (работает при auto_vacuum=INCREMENTAL).
+    # Через execute() sqlite3 делает один шаг = одна страница; executescript прогоняет до конца.
+    cursor.executescript("PRAGMA incremental_vacuum;")
+
+
 # =====================
 # ХЕНДЛЕРЫ БОТА
 # =====================
@@ -442,7 +711,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     if data == "nav:restart":
-        STATE.pop(key, None)
+        drop_session(key)
         try:
             await q.edit_message_reply_markup(reply_markup=None)
         except Exception:
@@ -457,26 +726,17 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sphere = data.split(":", 1)[1]
 
         picks = draw_three_cards()
-        STATE[key] = {
+        save_session(key, {
             "sphere": sphere,
             "choices": picks,
             "picked": None,
-        }
-
-        kb = [
-            [
-                InlineKeyboardButton("1️⃣", callback_data="pick:0"),
-                InlineKeyboardButton("2️⃣", callback_data="pick:1"),
-                InlineKeyboardButton("3️⃣", callback_data="pick:2"),
-            ],
-            [InlineKeyboardButton("🏠 В начало", callback_data="nav:home")],
-        ]
+        })
 
         sphere_ru = SPHERE_RU.get(sphere, "Общая")
 
         await q.edit_message_text(
             f"Сфера: {sphere_ru}\n\nТеперь выбери одну из трёх закрытых карт:",
-            reply_markup=InlineKeyboardMarkup(kb),
+            reply_markup=PICK_INLINE,
         )
         return
 
@@ -486,7 +746,7 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("pick:"):
         idx_in_three = int(data.split(":", 1)[1])
 
-        sess = STATE.get(key)
+        sess = load_session(key)
         if not sess:
             await q.edit_message_text(
                 "Сессия не найдена. Нажми /start, чтобы начать заново.",
@@ -503,24 +763,23 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await q.answer("Неверный выбор", show_alert=True)
             return
 
-        pick = sess["choices"][idx_in_three]
+        card_idx, is_reversed = sess["choices"][idx_in_three]
         sess["picked"] = idx_in_three
+        save_session(key, sess)
 
-        card_idx = pick["idx"]
-        is_reversed = pick["rev"]
         filename = get_card_filename(card_idx)
 
-        photo_data = fetch_and_rotate_image(filename, is_reversed)
-
-        title, text = get_card_text(filename, sess["sphere"], is_reversed, lang="ru")
+        title, text = get_card_text(card_idx, sess["sphere"], is_reversed, lang="ru")
 
         if text.startswith("Карта дня —"):
             caption = text
         else:
             caption = f"Карта дня — {title}\n\n{text}"
 
-        await q.message.reply_photo(
-            photo=photo_data,
+        await reply_card_photo(
+            q.message,
+            filename,
+            is_reversed,
             caption=caption,
             reply_markup=RESULT_INLINE,
         )
@@ -535,17 +794,28 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_main_menu(update, context)
 
 
+async def on_shutdown(app: Application):
+    await HTTP_CLIENT.aclose()
+
+
 def main():
     if not BOT_TOKEN:
         raise RuntimeError("Не задан BOT_TOKEN (переменная окружения).")
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("day", start))  # /day как алиас
 
     app.add_handler(CallbackQueryHandler(callback_handler))
 
+    app.job_queue.run_repeating(sweep_daily_sessions, interval=datetime.timedelta(days=1), first=0)
+
     # ReplyKeyboard (главное меню)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, menu_handler))
 